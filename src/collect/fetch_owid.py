@@ -4,14 +4,24 @@
 import os
 import sys
 import csv
+import ssl
+import glob
 import time
 import hashlib
 import logging
 from datetime import datetime
-from dateutil import tz
+from zoneinfo import ZoneInfo
 
 import requests
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pyarrow import csv as pacsv
+
+try:
+    import blake3  # optional: SIMD tree hash, much faster than SHA-256 on large files
+except ImportError:
+    blake3 = None
 
 # --- Project base config ---
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
@@ -37,69 +47,182 @@ SOURCES = {
     "owid_covid_data_github": "https://github.com/owid/covid-19-data/raw/master/public/data/owid-covid-data.csv"
 }
 
+_PARIS = ZoneInfo("Europe/Paris")
+
+# 1 MiB chunks are fed straight to the hasher so hashing stays in its native block loop
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+# Known OWID columns and their Arrow types; columns missing from the file are ignored and
+# any column not listed here (e.g. one newly added upstream) is left to Arrow's type inference
+STRING_COLS = ["iso_code", "continent", "location", "date", "tests_units"]
+NUMERIC_COLS = [
+    "total_cases", "new_cases", "new_cases_smoothed",
+    "total_deaths", "new_deaths", "new_deaths_smoothed",
+    "total_cases_per_million", "new_cases_per_million", "new_cases_smoothed_per_million",
+    "total_deaths_per_million", "new_deaths_per_million", "new_deaths_smoothed_per_million",
+    "reproduction_rate",
+    "icu_patients", "icu_patients_per_million", "hosp_patients", "hosp_patients_per_million",
+    "weekly_icu_admissions", "weekly_icu_admissions_per_million",
+    "weekly_hosp_admissions", "weekly_hosp_admissions_per_million",
+    "total_tests", "new_tests", "total_tests_per_thousand", "new_tests_per_thousand",
+    "new_tests_smoothed", "new_tests_smoothed_per_thousand",
+    "positive_rate", "tests_per_case",
+    "total_vaccinations", "people_vaccinated", "people_fully_vaccinated", "total_boosters",
+    "new_vaccinations", "new_vaccinations_smoothed",
+    "total_vaccinations_per_hundred", "people_vaccinated_per_hundred",
+    "people_fully_vaccinated_per_hundred", "total_boosters_per_hundred",
+    "new_vaccinations_smoothed_per_million",
+    "new_people_vaccinated_smoothed", "new_people_vaccinated_smoothed_per_hundred",
+    "stringency_index",
+    "population_density", "median_age", "aged_65_older", "aged_70_older", "gdp_per_capita",
+    "extreme_poverty", "cardiovasc_death_rate", "diabetes_prevalence",
+    "female_smokers", "male_smokers", "handwashing_facilities",
+    "hospital_beds_per_thousand", "life_expectancy", "human_development_index",
+    "population",
+    "excess_mortality_cumulative_absolute", "excess_mortality_cumulative",
+    "excess_mortality", "excess_mortality_cumulative_per_million"
+]
+COLUMN_TYPES = {
+    **{c: pa.string() for c in STRING_COLS},
+    **{c: pa.float64() for c in NUMERIC_COLS},
+}
+
 def timestamp_paris() -> str:
     """Return a timestamp YYYYMMDD_HHMMSS in Europe/Paris timezone."""
-    paris = tz.gettz("Europe/Paris")
-    return datetime.now(tz=paris).strftime("%Y%m%d_%H%M%S")
+    return datetime.now(_PARIS).strftime("%Y%m%d_%H%M%S")
+
+def snapshot_path(name: str) -> str:
+    ts = timestamp_paris()
+    return os.path.join(DATA_DIR, f"{name}_{ts}.csv")
+
+def latest_snapshot(name: str):
+    """Most recent Parquet snapshot of a source, or None."""
+    files = glob.glob(os.path.join(DATA_DIR, f"{name}_*.parquet"))
+    return max(files, key=os.path.getmtime) if files else None
+
+def read_etag(snapshot: str):
+    """ETag stored next to a snapshot, or None."""
+    etag_path = snapshot + ".etag"
+    if not os.path.exists(etag_path):
+        return None
+    with open(etag_path, encoding="utf-8") as f:
+        return f.read().strip() or None
+
+def write_etag(snapshot: str, etag: str):
+    with open(snapshot + ".etag", "w", encoding="utf-8") as f:
+        f.write(etag)
 
-def sha256_bytes(b: bytes) -> str:
-    return hashlib.sha256(b).hexdigest()
+def new_hasher():
+    """Return (algorithm name, hasher): BLAKE3 when installed, SHA-256 otherwise."""
+    if blake3 is not None:
+        return "blake3", blake3.blake3()
+    return "sha256", hashlib.sha256()
 
-def download_csv(url: str, timeout=60) -> bytes:
-    r = requests.get(url, timeout=timeout)
-    r.raise_for_status()
-    return r.content
+def download_to_file(url: str, path: str, etag=None, timeout=60):
+    """Stream the response to disk, hashing each chunk on the way.
 
-def validate_csv_bytes(b: bytes) -> bool:
+    Returns ("<algo>:<hexdigest>", size, etag), or None when the server answers 304 Not Modified.
+    """
+    headers = {"If-None-Match": etag} if etag else {}
+    algo, h = new_hasher()
+    size = 0
+    with requests.get(url, headers=headers, stream=True, timeout=timeout) as r:
+        if r.status_code == 304:
+            return None
+        r.raise_for_status()
+        try:
+            with open(path, "wb") as f:
+                for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    h.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+        except Exception:
+            # Don't leave a truncated snapshot behind for the ETL to pick up
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        return f"{algo}:{h.hexdigest()}", size, r.headers.get("ETag")
+
+def validate_csv_file(path: str, size: int) -> bool:
     """Basic validation: non-empty data + readable by pandas."""
-    if len(b) < 1000:  # avoid empty/HTML error responses
+    if size < 1000:  # avoid empty/HTML error responses
         return False
     try:
-        from io import BytesIO
-        _ = pd.read_csv(BytesIO(b), nrows=10)
+        _ = pd.read_csv(path, nrows=10)
         return True
     except Exception:
         return False
 
-def save_bytes_to_file(b: bytes, name: str) -> str:
-    ts = timestamp_paris()
-    path = os.path.join(DATA_DIR, f"{name}_{ts}.csv")
-    with open(path, "wb") as f:
-        f.write(b)
-    return path
-
-def quick_profile_csv(path: str) -> dict:
-    """Quick profile: number of rows/columns and check for key fields."""
-    df = pd.read_csv(path)
+def csv_to_parquet(csv_path: str) -> str:
+    """Convert a downloaded CSV snapshot to Parquet (Snappy) and drop the CSV."""
+    pq_path = os.path.splitext(csv_path)[0] + ".parquet"
+    convert_options = pacsv.ConvertOptions(
+        column_types=COLUMN_TYPES,
+        null_values=["", "NA"],
+        strings_can_be_null=True,
+    )
+    try:
+        table = pacsv.read_csv(csv_path, convert_options=convert_options)
+        pq.write_table(table, pq_path, compression="snappy")
+    except Exception:
+        # Same as a failed download: leave neither the CSV nor a partial Parquet behind
+        for path in (csv_path, pq_path):
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    os.remove(csv_path)
+    return pq_path
+
+def quick_profile_parquet(path: str) -> dict:
+    """Quick profile from the Parquet footer only: number of rows/columns and check for key fields."""
+    pf = pq.ParquetFile(path)
+    columns = pf.schema_arrow.names
     profile = {
-        "rows": len(df),
-        "cols": len(df.columns),
-        "has_date": "date" in df.columns,
-        "has_location": "location" in df.columns,
-        "columns_sample": df.columns[:10].tolist()
+        "rows": pf.metadata.num_rows,
+        "cols": len(columns),
+        "has_date": "date" in columns,
+        "has_location": "location" in columns,
+        "columns_sample": columns[:10]
     }
     return profile
 
 def main():
     logging.info("=== START OWID COVID COLLECTION ===")
+    # Make a fallback to SHA-256, or to a non-accelerated (non-OpenSSL) build of it, visible in the logs
+    if blake3 is not None:
+        logging.info("Hash backend: blake3")
+    else:
+        # "_hashlib" means OpenSSL, whose build decides SHA-NI support; "_sha256" (Python 3.11)
+        # or "_sha2" (3.12+) is the builtin, non-accelerated fallback
+        logging.info(f"Hash backend: sha256 via {type(hashlib.sha256()).__module__} ({ssl.OPENSSL_VERSION})")
     started = time.time()
     results = []
 
     for name, url in SOURCES.items():
         try:
             logging.info(f"Downloading: {name} <- {url}")
-            b = download_csv(url)
-            digest = sha256_bytes(b)
-            logging.info(f"Checksum SHA-256: {digest[:16]}…")
+            previous = latest_snapshot(name)
+            csv_path = snapshot_path(name)
+            downloaded = download_to_file(url, csv_path, etag=read_etag(previous) if previous else None)
+            if downloaded is None:
+                logging.info(f"Not modified since last run, reusing: {previous}")
+                continue
+            digest, size, etag = downloaded
+            logging.info(f"Upstream CSV checksum {digest[:24]}… ({size} bytes)")
 
-            if not validate_csv_bytes(b):
+            if not validate_csv_file(csv_path, size):
                 logging.error(f"Validation failed for {name} (invalid content).")
+                os.remove(csv_path)
                 continue
 
-            out_path = save_bytes_to_file(b, name)
-            prof = quick_profile_csv(out_path)
+            out_path = csv_to_parquet(csv_path)
+            if etag:
+                write_etag(out_path, etag)
+            prof = quick_profile_parquet(out_path)
             logging.info(f"Saved: {out_path} | Profile: {prof}")
 
+            # path is the stored Parquet; the digest is of the upstream CSV payload as downloaded
+            # (that CSV is deleted after conversion, so it identifies the source version, not this file)
             results.append({
                 "name": name,
                 "path": out_path,
@@ -114,22 +237,27 @@ def main():
     logging.info(f"=== END COLLECTION (ok={len(results)}) in {elapsed:.1f}s ===")
 
     # Write summary to CSV (append mode)
+    if not results:
+        return
     recap_path = os.path.join(LOG_DIR, "collect_history.csv")
+    # The "sha256" column keeps its name for existing history files; values carry an "<algo>:" prefix
+    # and are digests of the upstream CSV payload, not of the Parquet file in "path"
     fieldnames = ["ts_paris", "name", "path", "sha256", "rows", "cols"]
+    ts = timestamp_paris()
+    rows = [{
+        "ts_paris": ts,
+        "name": r["name"],
+        "path": r["path"],
+        "sha256": r["sha256"],
+        "rows": r["profile"]["rows"],
+        "cols": r["profile"]["cols"],
+    } for r in results]
     exists = os.path.exists(recap_path)
     with open(recap_path, "a", newline="", encoding="utf-8") as f:
         w = csv.DictWriter(f, fieldnames=fieldnames)
         if not exists:
             w.writeheader()
-        for r in results:
-            w.writerow({
-                "ts_paris": timestamp_paris(),
-                "name": r["name"],
-                "path": r["path"],
-                "sha256": r["sha256"],
-                "rows": r["profile"]["rows"],
-                "cols": r["profile"]["cols"],
-            })
+        w.writerows(rows)
 
 if __name__ == "__main__":
     main()
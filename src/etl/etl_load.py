@@ -2,21 +2,80 @@
 # -*- coding: utf-8 -*-
 
 import os
+import glob
 import sqlite3
-import pandas as pd
+from itertools import islice
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 
 # --- Config ---
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
 DATA_DIR = os.path.join(PROJECT_ROOT, "data", "raw")
 DB_PATH = os.path.join(PROJECT_ROOT, "data", "covid19.db")
 
-# Find the latest OWID CSV (most recent)
-def get_latest_csv():
-    files = [f for f in os.listdir(DATA_DIR) if f.startswith("owid_covid_data") and f.endswith(".csv")]
-    files.sort(reverse=True)
+# Columns of the static per-country table
+LOC_COLS = [
+    "iso_code", "continent", "location", "population", "population_density",
+    "median_age", "aged_65_older", "aged_70_older", "gdp_per_capita",
+    "extreme_poverty", "cardiovasc_death_rate", "diabetes_prevalence",
+    "female_smokers", "male_smokers", "handwashing_facilities",
+    "hospital_beds_per_thousand", "life_expectancy", "human_development_index"
+]
+
+# Columns of the time-series table (same order as the covid_stats schema)
+STAT_COLS = [
+    "iso_code", "date",
+    "total_cases", "new_cases", "new_cases_smoothed",
+    "total_deaths", "new_deaths", "new_deaths_smoothed",
+    "total_cases_per_million", "new_cases_per_million", "new_cases_smoothed_per_million",
+    "total_deaths_per_million", "new_deaths_per_million", "new_deaths_smoothed_per_million",
+    "reproduction_rate",
+    "icu_patients", "icu_patients_per_million", "hosp_patients", "hosp_patients_per_million",
+    "weekly_icu_admissions", "weekly_icu_admissions_per_million",
+    "weekly_hosp_admissions", "weekly_hosp_admissions_per_million",
+    "total_tests", "new_tests", "total_tests_per_thousand", "new_tests_per_thousand",
+    "new_tests_smoothed", "new_tests_smoothed_per_thousand",
+    "positive_rate", "tests_per_case", "tests_units",
+    "total_vaccinations", "people_vaccinated", "people_fully_vaccinated", "total_boosters",
+    "new_vaccinations", "new_vaccinations_smoothed",
+    "total_vaccinations_per_hundred", "people_vaccinated_per_hundred",
+    "people_fully_vaccinated_per_hundred", "total_boosters_per_hundred",
+    "new_vaccinations_smoothed_per_million",
+    "new_people_vaccinated_smoothed", "new_people_vaccinated_smoothed_per_hundred",
+    "stringency_index",
+    "excess_mortality_cumulative_absolute", "excess_mortality_cumulative",
+    "excess_mortality", "excess_mortality_cumulative_per_million"
+]
+
+# Upper bound on rows per multi-VALUES INSERT; the actual count also respects the
+# connection's bound-parameter limit (32766 since SQLite 3.32, 999 before)
+ROWS_PER_STMT = 100
+
+def insert_sql(table, cols, nrows=1):
+    row_placeholder = "(" + ",".join(["?"] * len(cols)) + ")"
+    return f"INSERT INTO {table} ({','.join(cols)}) VALUES " + ",".join([row_placeholder] * nrows)
+
+# INSERT statements are built once at import so every call reuses the same cached prepared statement
+_LOC_SQL = insert_sql("locations", LOC_COLS)
+_STATS_SQL = insert_sql("covid_stats", STAT_COLS)
+_STATS_SQL_100 = insert_sql("covid_stats", STAT_COLS, ROWS_PER_STMT)
+
+# Find the latest OWID snapshot (most recent)
+def get_latest_parquet():
+    files = glob.glob(os.path.join(DATA_DIR, "owid_covid_data_*.parquet"))
     if not files:
         raise FileNotFoundError("No OWID file found in data/raw/")
-    return os.path.join(DATA_DIR, files[0])
+    return max(files, key=os.path.getmtime)
+
+def configure_connection(conn):
+    # The database is rebuilt from the snapshot on every run, so trade durability for insert speed
+    conn.executescript("""
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA cache_size=-262144;
+        PRAGMA mmap_size=268435456;
+    """)
 
 def create_schema(conn):
     cur = conn.cursor()
@@ -52,7 +111,7 @@ def create_schema(conn):
     # Table covid_stats (time series)
     cur.execute("""
         CREATE TABLE covid_stats (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            id INTEGER PRIMARY KEY,
             iso_code TEXT,
             date TEXT,
             total_cases REAL,
@@ -106,36 +165,90 @@ def create_schema(conn):
             FOREIGN KEY(iso_code) REFERENCES locations(iso_code)
         );
     """)
-    conn.commit()
 
-def load_data(conn, csv_path):
-    print(f"Loading {csv_path} ...")
-    df = pd.read_csv(csv_path)
+def insert_rows(conn, sql, rows):
+    """Bulk insert rows with a single prepared INSERT."""
+    conn.executemany(sql, rows)
+
+def iter_table_rows(table, batch_size=10000):
+    """Yield the rows of an Arrow table as tuples, one record batch at a time."""
+    for batch in table.to_batches(max_chunksize=batch_size):
+        yield from zip(*[c.to_pylist() for c in batch.columns])
 
-    # Keep only rows with iso_code and date
-    df = df.dropna(subset=["iso_code", "date"])
-    df["date"] = pd.to_datetime(df["date"], errors="coerce").dt.strftime("%Y-%m-%d")
+def stats_rows_per_stmt(conn):
+    """Rows per multi-row covid_stats INSERT that fit under the SQLite parameter limit."""
+    if hasattr(conn, "getlimit"):  # Python 3.11+
+        max_vars = conn.getlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER)
+    else:
+        max_vars = 32766 if sqlite3.sqlite_version_info >= (3, 32, 0) else 999
+    return max(1, min(ROWS_PER_STMT, max_vars // len(STAT_COLS)))
 
-    # Extract locations table (one row per country)
-    loc_cols = [
-        "iso_code", "continent", "location", "population", "population_density",
-        "median_age", "aged_65_older", "aged_70_older", "gdp_per_capita",
-        "extreme_poverty", "cardiovasc_death_rate", "diabetes_prevalence",
-        "female_smokers", "male_smokers", "handwashing_facilities",
-        "hospital_beds_per_thousand", "life_expectancy", "human_development_index"
-    ]
-    df_locations = df[loc_cols].drop_duplicates(subset=["iso_code"])
+def chunked_insert(conn, single_sql, multi_sql, rows, rows_per_stmt=ROWS_PER_STMT):
+    """Insert rows_per_stmt rows per statement with the multi-row VALUES statement.
 
-    # Extract covid_stats table (time series)
-    stat_cols = [c for c in df.columns if c not in loc_cols and c not in ["continent", "location", "population"]]
-    df_stats = df[stat_cols].copy()
+    The trailing partial chunk goes through the single-row statement.
+    """
+    it = iter(rows)
+    while True:
+        chunk = list(islice(it, rows_per_stmt))
+        if len(chunk) < rows_per_stmt:
+            if chunk:
+                conn.executemany(single_sql, chunk)
+            break
+        conn.execute(multi_sql, [v for row in chunk for v in row])
 
-    # Load into SQL
-    df_locations.to_sql("locations", conn, if_exists="append", index=False)
-    df_stats.to_sql("covid_stats", conn, if_exists="append", index=False)
+def load_data(conn, parquet_path):
+    print(f"Loading {parquet_path} ...")
+    columns = LOC_COLS + [c for c in STAT_COLS if c not in LOC_COLS]
+    table = pq.read_table(parquet_path, columns=columns)
 
-    print(f"{len(df_locations)} locations inserted into 'locations'")
-    print(f"{len(df_stats)} rows inserted into 'covid_stats'")
+    # Keep only rows with iso_code and a valid date, with a single mask built from those two columns.
+    # OWID dates are already ISO strings: validate them in Arrow and keep the original column.
+    # strptime normalizes overflowing days (2021-02-30 -> 2021-03-02) and accepts 2021-1-5,
+    # so a date is only valid if formatting it back gives the original string.
+    dates = pc.strptime(table["date"], format="%Y-%m-%d", unit="s", error_is_null=True)
+    canonical = pc.equal(pc.strftime(dates, format="%Y-%m-%d"), table["date"])
+    mask = pc.and_(pc.is_valid(table["iso_code"]), pc.fill_null(canonical, False))
+    table = table.filter(mask)
+
+    # Extract locations table: first non-null value of each column per iso_code
+    # (unlike drop_duplicates, a row may combine values from different source rows)
+    other_cols = [c for c in LOC_COLS if c != "iso_code"]
+    locations = (
+        table.select(LOC_COLS)
+        .group_by("iso_code", use_threads=False)
+        .aggregate([(c, "first") for c in other_cols])
+    )
+    locations = locations.select(["iso_code"] + [f"{c}_first" for c in other_cols]).rename_columns(LOC_COLS)
+
+    # covid_stats rows are streamed from the Arrow table (time series)
+    stats = table.select(STAT_COLS)
+
+    rows_per_stmt = stats_rows_per_stmt(conn)
+    if rows_per_stmt == ROWS_PER_STMT:
+        stats_multi_sql = _STATS_SQL_100
+    else:
+        stats_multi_sql = insert_sql("covid_stats", STAT_COLS, rows_per_stmt)
+
+    # Load into SQL (both tables in one transaction)
+    conn.execute("BEGIN")
+    try:
+        insert_rows(conn, _LOC_SQL, iter_table_rows(locations))
+        chunked_insert(conn, _STATS_SQL, stats_multi_sql, iter_table_rows(stats), rows_per_stmt)
+        conn.execute("COMMIT")
+    except Exception:
+        # SQLite may already have rolled back (e.g. SQLITE_FULL); don't mask the original error
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+
+    print(f"{locations.num_rows} locations inserted into 'locations'")
+    print(f"{stats.num_rows} rows inserted into 'covid_stats'")
+
+def create_indexes(conn):
+    # Built once after the bulk load rather than maintained row by row during it
+    cur = conn.cursor()
+    cur.execute("CREATE INDEX idx_stats_iso_date ON covid_stats(iso_code, date);")
 
 def quick_test(conn):
     cur = conn.cursor()
@@ -157,11 +270,15 @@ def quick_test(conn):
     print("Latest France sample:", rows)
 
 def main():
-    csv_path = get_latest_csv()
-    conn = sqlite3.connect(DB_PATH)
+    parquet_path = get_latest_parquet()
+    # Autocommit mode: transactions are opened explicitly (see load_data)
+    conn = sqlite3.connect(DB_PATH, isolation_level=None)
+    configure_connection(conn)
+    conn.set_trace_callback(None)
 
     create_schema(conn)
-    load_data(conn, csv_path)
+    load_data(conn, parquet_path)
+    create_indexes(conn)
     quick_test(conn)
 
     conn.close()